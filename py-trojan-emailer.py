@@ -1,120 +1,416 @@
 #! python3
 
 import os
+import re
 import csv
+import queue
 import logging
 import smtplib
 import argparse
-from time import sleep
+import itertools
+import threading
+from time import sleep, monotonic
 from email import encoders
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 
+# SMTP reply codes signalling a temporary condition worth retrying on a fresh connection
+TRANSIENT_SMTP_CODES = (421, 450, 454)
+# Failures which will recur on every connection, continuing would only repeat them against the server
+FATAL_SMTP_ERRORS = (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError)
+# Refusals of a single message, smtplib has already reset the transaction so the session can carry on being used
+MESSAGE_REFUSED_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+MAX_DELIVERY_ATTEMPTS = 3
+SMTPS_PORT = 465
+# Seconds a reused SMTP session may sit idle before it is checked with a NOOP, servers commonly drop idle clients
+SMTP_IDLE_PROBE_SECONDS = 60
 
-def send_email(recipient_email_addresss, cli_arguments, replacement_values=None):
-    """Build and send an email"""
+# Number of CSV rows shown to the user for confirmation before mass emailing begins
+PREVIEW_RECIPIENT_COUNT = 10
+# Stand-in To address of a message serialized once and then readdressed for every recipient
+RECIPIENT_PLACEHOLDER = '__TO__'
+# Accepted answers to a yes/no prompt, an empty answer selects the default
+CONFIRMATION_CHOICES = frozenset(('y', 'n', ''))
+
+
+def compile_placeholder_pattern(placeholder_names):
+    """Build a single regular expression matching the $name$ placeholder of every substitution field.
+    Longer names are tried first so a field which prefixes another can not shadow it."""
+
+    alternatives = '|'.join(re.escape(name) for name in sorted(placeholder_names, key=len, reverse=True))
+    return re.compile(r'\$({0})\$'.format(alternatives))
+
+
+def prepare_headers(cli_arguments):
+    """Format the sender and carbon copy headers a single time, storing them on the arguments as prepared_from and
+    prepared_cc. prepared_cc is None when no carbon copy display name was provided. The SMTP envelope sender is
+    stored as prepared_envelope_sender."""
 
-    # Create an email and setup headers
-    email_message = MIMEMultipart('alternative')
-    email_message['Subject'] = cli_arguments.email_subject
-    email_message['To'] = recipient_email_addresss
     if cli_arguments.hide_source_email is False:
-        email_message['From'] = '"{0}" <{1}>'.format(cli_arguments.sender_display_name, cli_arguments.sender_address)
+        cli_arguments.prepared_from = '"{0}" <{1}>'.format(cli_arguments.sender_display_name,
+                                                           cli_arguments.sender_address)
     else:
         space_hack = (' ' * 200) + '|'
-        email_message['From'] = '"{0} {2}" <{1}>'.format(cli_arguments.sender_display_name, cli_arguments.sender_address, space_hack)
-    email_message['X-Priority'] = cli_arguments.message_priority
+        cli_arguments.prepared_from = '"{0} {2}" <{1}>'.format(cli_arguments.sender_display_name,
+                                                               cli_arguments.sender_address, space_hack)
 
-    # Add a spoofed carbon copy if provided
+    cli_arguments.prepared_cc = None
     if cli_arguments.cc_display_name is not None:
-        email_message['CC'] = '"{0}" <>'.format(cli_arguments.cc_display_name)
+        cli_arguments.prepared_cc = '"{0}" <>'.format(cli_arguments.cc_display_name)
 
-    # Setup the email body
-    email_body = cli_arguments.email_body.read()
-    # Reset the cursor to the start in order to read the file multiple times
-    cli_arguments.email_body.seek(0)
+    # perform SPF spoofing by setting the envelope and message headers with different senders
+    cli_arguments.prepared_envelope_sender = cli_arguments.envelope_sender_address or cli_arguments.sender_address
 
-    # Replace placeholder values if substitution data is provided
-    if replacement_values is not None:
-        for key, value in replacement_values.items():
-            replacement_egg = '${0}$'.format(key)
-            logging.debug('Replacing [%s] with [%s]', replacement_egg, value)
-            email_body = email_body.replace(replacement_egg, value)
 
-    encoded_message = MIMEText(email_body, cli_arguments.message_format)
-    email_message.attach(encoded_message)
+def prepare_attachment(cli_arguments):
+    """Read and encode the optional attachment a single time. The resulting MIME part is stored on the arguments as
+    prepared_attachment, or None if no attachment was provided, and is shared between every message sent."""
 
-    # Add an attachment if provided
+    cli_arguments.prepared_attachment = None
     if cli_arguments.email_attachment is not None:
         attachment_file_name = os.path.basename(cli_arguments.email_attachment.name)
 
         email_message_attachment = MIMEBase('application', 'octet-stream')
         email_message_attachment.set_payload(cli_arguments.email_attachment.read())
-        # Reset the cursor to the start of the file in case it needs to be sent multiple times
-        cli_arguments.email_attachment.seek(0)
+        cli_arguments.email_attachment.close()
         encoders.encode_base64(email_message_attachment)
         email_message_attachment['Content-Disposition'] = 'attachment; filename= {0}'.format(attachment_file_name)
+        cli_arguments.prepared_attachment = email_message_attachment
 
-        email_message.attach(email_message_attachment)
 
-    # Create a connection to the SMTP server and deliver the message
-    with smtplib.SMTP(cli_arguments.smtp_server, cli_arguments.smtp_port) as smtp_server:
+def build_template(cli_arguments, placeholder_names=()):
+    """Split the email body read at startup on the $name$ placeholders of the substitution fields into alternating
+    literal text and field names, so it can be shared between messages."""
 
-        # Setup a TLS connection and authenticate to the SMTP service
-        if cli_arguments.smtp_username is not None:
-            logging.info('Logging into %s on port %i using user: %s', cli_arguments.smtp_server,
-                         cli_arguments.smtp_port, cli_arguments.smtp_username)
-            smtp_server.ehlo()
-            smtp_server.starttls()
-            smtp_server.ehlo()
-            smtp_server.login(cli_arguments.smtp_username, cli_arguments.smtp_password)
+    email_body = cli_arguments.email_body_text
+    # A body without any dollar signs can not contain placeholders, so skip building the pattern entirely
+    if placeholder_names and '$' in email_body:
+        body_segments = compile_placeholder_pattern(placeholder_names).split(email_body)
+    else:
+        body_segments = [email_body]
 
-        # continue sending email
-        logging.info('Sending an email to %s', recipient_email_addresss)
+    return body_segments
+
+
+def render_body(body_segments, replacement_values):
+    """Join the literal body segments with the recipient's value for each placeholder between them"""
+
+    # Bodies without placeholders are sent unchanged
+    if len(body_segments) == 1:
+        return body_segments[0]
+
+    rendered_segments = list(body_segments)
+    rendered_segments[1::2] = [replacement_values[name] for name in body_segments[1::2]]
+    # Only walk the replacements for logging when debug output is enabled
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        for name, value in zip(body_segments[1::2], rendered_segments[1::2]):
+            logging.debug('Replacing [$%s$] with [%s]', name, value)
+
+    return ''.join(rendered_segments)
+
+
+def build_message(recipient_email_addresss, body_segments, cli_arguments, replacement_values=None):
+    """Build an email for a single recipient from a prepared body template"""
+
+    # Setup the email body, filling in placeholder values from the pre-split template
+    email_body = render_body(body_segments, replacement_values)
+    encoded_message = MIMEText(email_body, cli_arguments.message_format)
+
+    # A lone body is sent as a single part, a multipart container is only needed to carry an attachment
+    if cli_arguments.prepared_attachment is None:
+        email_message = encoded_message
+    else:
+        email_message = MIMEMultipart('alternative')
+        email_message.attach(encoded_message)
+        # The encoded attachment part is shared between messages
+        email_message.attach(cli_arguments.prepared_attachment)
+
+    # Setup headers
+    email_message['Subject'] = cli_arguments.email_subject
+    email_message['To'] = recipient_email_addresss
+    email_message['From'] = cli_arguments.prepared_from
+    email_message['X-Priority'] = cli_arguments.message_priority
+
+    # Add a spoofed carbon copy if provided
+    if cli_arguments.prepared_cc is not None:
+        email_message['CC'] = cli_arguments.prepared_cc
+
+    return email_message
+
+
+def serialize_message(email_message):
+    """Flatten a message into the CRLF delimited bytes sent to the SMTP server"""
+
+    return email_message.as_bytes(policy=email_message.policy.clone(linesep='\r\n'))
+
+
+def build_shared_message(body_segments, cli_arguments):
+    """Serialize a message a single time when the body has no placeholders and so is identical for every recipient.
+    Returns None when the body differs between recipients and each message must be built individually."""
+
+    if len(body_segments) != 1:
+        return None
+
+    return serialize_message(build_message(RECIPIENT_PLACEHOLDER, body_segments, cli_arguments))
 
-        # perform SPF spoofing by setting the envelope and message headers with different recipients
-        if cli_arguments.envelope_sender_address is not None:
-            smtp_server.send_message(email_message, from_addr=cli_arguments.envelope_sender_address)
-        else:
-            smtp_server.send_message(email_message)
+
+def address_shared_message(shared_message, recipient_email_addresss):
+    """Swap the placeholder To header of a pre-serialized message for a recipient's address. The match is anchored to
+    the start of a header line, To is never the first header written, so a subject containing the same text is left
+    alone."""
+
+    return shared_message.replace('\r\nTo: {0}\r\n'.format(RECIPIENT_PLACEHOLDER).encode('ascii'),
+                                  '\r\nTo: {0}\r\n'.format(recipient_email_addresss).encode('utf-8'), 1)
+
+
+def connect_smtp_server(cli_arguments):
+    """Open a connection to the SMTP server, authenticating if credentials are provided"""
+
+    # Port 465 expects TLS from the first byte rather than an upgrade through STARTTLS
+    if cli_arguments.smtp_port == SMTPS_PORT:
+        smtp_server = smtplib.SMTP_SSL(cli_arguments.smtp_server, cli_arguments.smtp_port,
+                                       timeout=cli_arguments.smtp_timeout)
+    else:
+        smtp_server = smtplib.SMTP(cli_arguments.smtp_server, cli_arguments.smtp_port,
+                                   timeout=cli_arguments.smtp_timeout)
+
+    # Setup a TLS connection and authenticate to the SMTP service
+    if cli_arguments.smtp_username is not None:
+        logging.info('Logging into %s on port %i using user: %s', cli_arguments.smtp_server,
+                     cli_arguments.smtp_port, cli_arguments.smtp_username)
+        smtp_server.ehlo_or_helo_if_needed()
+        if not isinstance(smtp_server, smtplib.SMTP_SSL):
+            # Never send credentials in the clear, starttls raises if the server does not advertise it.
+            # login repeats the EHLO itself once STARTTLS has reset the session state.
+            try:
+                smtp_server.starttls()
+            except smtplib.SMTPNotSupportedError:
+                smtp_server.close()
+                raise
+        smtp_server.login(cli_arguments.smtp_username, cli_arguments.smtp_password)
+
+    return smtp_server
+
+
+def is_transient_smtp_error(smtp_error, recipient_email_addresss=None):
+    """Decide whether an SMTP or socket failure is temporary and worth retrying on a fresh connection"""
+
+    if isinstance(smtp_error, smtplib.SMTPResponseException):
+        return smtp_error.smtp_code in TRANSIENT_SMTP_CODES
+    if isinstance(smtp_error, smtplib.SMTPRecipientsRefused):
+        # A refused sole recipient, such as a greylisting 450 at RCPT, is reported per address
+        return smtp_error.recipients.get(recipient_email_addresss, (None,))[0] in TRANSIENT_SMTP_CODES
+    if isinstance(smtp_error, smtplib.SMTPServerDisconnected):
+        return True
+    # Other smtplib errors, such as a missing extension, will not change on a new connection but socket errors may
+    return not isinstance(smtp_error, smtplib.SMTPException)
+
+
+def open_smtp_session(cli_arguments):
+    """Connect to the SMTP server, retrying transient failures such as a 421 greeting or a timeout with an
+    exponential backoff. The last error is raised once MAX_DELIVERY_ATTEMPTS connections have failed."""
+
+    for attempt in range(MAX_DELIVERY_ATTEMPTS):
+        try:
+            return connect_smtp_server(cli_arguments)
+        except OSError as connection_error:
+            if not is_transient_smtp_error(connection_error) or attempt == MAX_DELIVERY_ATTEMPTS - 1:
+                raise
+
+            backoff = 2 ** attempt
+            logging.warning('Temporary failure connecting to %s (%s), retrying in %i seconds',
+                            cli_arguments.smtp_server, connection_error, backoff)
+            sleep(backoff)
+
+
+def deliver_email(smtp_server, recipient_email_addresss, message_bytes, cli_arguments):
+    """Send a serialized message over an SMTP session, opening one if None is passed. Transient failures, including
+    a server which stops responding within the timeout, are retried with an exponential backoff on a fresh
+    connection. A timeout after the message data was sent can not be told apart from one before it, so the retry may
+    deliver that message twice. Returns the session in use afterwards, which is replaced whenever a reconnect occurs.
+    A session opened here is closed again if the message ultimately fails."""
+
+    original_smtp_server = smtp_server
+
+    for attempt in range(MAX_DELIVERY_ATTEMPTS):
+        if smtp_server is None:
+            smtp_server = open_smtp_session(cli_arguments)
+
+        try:
+            logging.info('Sending an email to %s', recipient_email_addresss)
+            # The recipient is the only envelope address, the display-only CC from --blank-copy is not sent an RCPT
+            smtp_server.sendmail(cli_arguments.prepared_envelope_sender, [recipient_email_addresss], message_bytes)
+            return smtp_server
+        except OSError as smtp_error:
+            if (not is_transient_smtp_error(smtp_error, recipient_email_addresss) or
+                    attempt == MAX_DELIVERY_ATTEMPTS - 1):
+                if smtp_server is not original_smtp_server:
+                    smtp_server.close()
+                raise
+
+            backoff = 2 ** attempt
+            logging.warning('Temporary SMTP failure (%s), reconnecting in %i seconds', smtp_error, backoff)
+            if smtp_server is not None:
+                smtp_server.close()
+                smtp_server = None
+            sleep(backoff)
+
+
+def check_smtp_session(smtp_server):
+    """Probe an idle SMTP session with a NOOP. Returns the session if it is still usable, otherwise it is closed and
+    None is returned so the next delivery opens a fresh connection."""
+
+    try:
+        if smtp_server.noop()[0] == 250:
+            return smtp_server
+    except (smtplib.SMTPException, OSError):
+        pass
+
+    logging.debug('Idle SMTP session is no longer usable, reconnecting')
+    smtp_server.close()
+    return None
+
+
+def send_email(recipient_email_addresss, body_segments, cli_arguments, replacement_values=None):
+    """Build and send an email"""
+
+    email_message = build_message(recipient_email_addresss, body_segments, cli_arguments, replacement_values)
+    smtp_server = deliver_email(None, recipient_email_addresss, serialize_message(email_message), cli_arguments)
+    smtp_server.quit()
+
+
+def email_worker(recipient_queue, stop_sending, body_segments, shared_message, cli_arguments):
+    """Deliver messages to recipients pulled from a shared queue, reusing a single SMTP session between them.
+    A pre-serialized shared message is readdressed for each recipient rather than rebuilt when one is provided.
+    Failing to authenticate, or to connect once the retries are exhausted, sets the stop_sending event, after which
+    every worker discards the remaining recipients instead of retrying them. The worker stops once it receives None from the queue."""
+
+    smtp_server = None
+    next_send_time = monotonic()
+    session_last_used = next_send_time
+
+    while True:
+        individual_recipient = recipient_queue.get()
+        if individual_recipient is None:
+            break
+        if stop_sending.is_set():
+            continue
+
+        # Pace sends from the start of the previous one, so time spent talking to the server counts towards the delay
+        sleep(max(0, next_send_time - monotonic()))
+        next_send_time = monotonic() + cli_arguments.sending_delay
+
+        recipient_email_addresss = individual_recipient['EmailAddress']
+        logging.debug('Processing an email to %s', recipient_email_addresss)
+        try:
+            if shared_message is not None:
+                message_bytes = address_shared_message(shared_message, recipient_email_addresss)
+            else:
+                message_bytes = serialize_message(build_message(recipient_email_addresss, body_segments, cli_arguments,
+                                                                individual_recipient))
+        except Exception as build_error:
+            logging.error('Failed to build an email to %s: %s', recipient_email_addresss, build_error)
+            continue
+
+        # Sessions are kept open between messages, make sure a long idle one has not been dropped by the server
+        if smtp_server is not None and monotonic() - session_last_used > SMTP_IDLE_PROBE_SECONDS:
+            smtp_server = check_smtp_session(smtp_server)
+
+        # A session that still can not be established after retrying will not succeed for later recipients either
+        if smtp_server is None:
+            try:
+                smtp_server = open_smtp_session(cli_arguments)
+            except Exception as connection_error:
+                logging.error('Unable to connect to %s, no further emails will be sent: %s',
+                              cli_arguments.smtp_server, connection_error)
+                stop_sending.set()
+                continue
+
+        try:
+            smtp_server = deliver_email(smtp_server, recipient_email_addresss, message_bytes, cli_arguments)
+            session_last_used = monotonic()
+        except FATAL_SMTP_ERRORS as smtp_error:
+            logging.error('Failed to send an email to %s, no further emails will be sent: %s',
+                          recipient_email_addresss, smtp_error)
+            stop_sending.set()
+        except MESSAGE_REFUSED_ERRORS as refused_error:
+            logging.error('Failed to send an email to %s: %s', recipient_email_addresss, refused_error)
+            # Keep the session unless deliver_email already closed it while reconnecting
+            if smtp_server.sock is None:
+                smtp_server = None
+        except Exception as send_error:
+            # Any failure is confined to this row so the worker keeps draining the queue for the producer
+            logging.error('Failed to send an email to %s: %s', recipient_email_addresss, send_error)
+            smtp_server.close()
+            smtp_server = None
+
+    if smtp_server is not None:
+        try:
+            smtp_server.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
 
 
 def send_multiple_emails(recipient_file, cli_arguments):
     """Process through a CSV containing multiple recipients and optional message substitution data.
        After some basic error validation the user must confirm recipients are appropriate before mass emailing begins."""
 
-    recipient_information = list(csv.DictReader(recipient_file))
+    # Rows are streamed from the file, only the preview rows are held in memory. Cells missing from short rows are
+    # read as empty strings so they substitute as blanks.
+    recipient_reader = csv.DictReader(recipient_file, restval='')
+
+    # Confirm the required field of EmailAddress is present in the header before any data rows are read
+    if 'EmailAddress' not in frozenset(recipient_reader.fieldnames or ()):
+        logging.error('Looks like the EmailAddress field was not included in the recipient CSV file. '
+                      'This is a required item and must be included.')
+        exit()
+
+    preview_recipients = list(itertools.islice(recipient_reader, PREVIEW_RECIPIENT_COUNT))
 
     # Confirm at least one recipient is provided
-    if len(recipient_information) < 1:
+    if len(preview_recipients) < 1:
         logging.error('The provided CSV is too short. There should be at least two rows. '
                       'The header row and one row of data.')
         exit()
 
-    # Confirm the required field of EmailAddress is present
-    if 'EmailAddress' not in recipient_information[0]:
-        logging.error('Looks like the EmailAddress field was not included in the recipient CSV file. '
-                      'This is a required item and must be included.')
-        exit()
-
     # Required the user to perform a sanity check before sending multiple emails
-    logging.info('The following %i emails are about to be sent:', len(recipient_information))
+    logging.info('The first %i emails about to be sent are:', len(preview_recipients))
 
-    for individual_recipient in recipient_information:
-        logging.info('--------------------')
-        for key, value in individual_recipient.items():
-            logging.info('[%s] %s', key, value)
+    # Log each row as a single record, skipping the formatting entirely when informational logging is disabled
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        for individual_recipient in preview_recipients:
+            logging.info('--------------------\n%s', '\n'.join('[{0}] {1}'.format(key, value)
+                                                               for key, value in individual_recipient.items()))
 
     if confirm_action('Before multiple emails are sent, do these values look correct?', 'y') is False:
         logging.warning('User termination. Improper values detected.')
         exit()
 
-    # Start sending emails to all recipients
-    for individual_recipient in recipient_information:
-        logging.debug('Processing an email to %s', individual_recipient['EmailAddress'])
-        send_email(individual_recipient['EmailAddress'], cli_arguments, individual_recipient)
-        sleep(cli_arguments.sending_delay)
+    # Prepare the message content shared by every email, with a placeholder for each CSV column
+    body_segments = build_template(cli_arguments, recipient_reader.fieldnames)
+    shared_message = build_shared_message(body_segments, cli_arguments)
+
+    # Start sending emails to all recipients, spread across a pool of workers each holding its own SMTP session.
+    # The queue is bounded so rows are only read from the file as fast as the workers can send them.
+    recipient_queue = queue.Queue(maxsize=cli_arguments.concurrency * 2)
+    stop_sending = threading.Event()
+    workers = [threading.Thread(target=email_worker, daemon=True,
+                                args=(recipient_queue, stop_sending, body_segments, shared_message, cli_arguments))
+               for _ in range(cli_arguments.concurrency)]
+    for worker in workers:
+        worker.start()
+
+    for individual_recipient in itertools.chain(preview_recipients, recipient_reader):
+        if stop_sending.is_set():
+            break
+        recipient_queue.put(individual_recipient)
+    # Signal every worker that there are no more recipients
+    for _ in workers:
+        recipient_queue.put(None)
+
+    for worker in workers:
+        worker.join()
 
 
 def confirm_action(question, default):
@@ -128,13 +424,11 @@ def confirm_action(question, default):
         prompt = ' [y/N] '
 
     while True:
-        logging.info(question + prompt)
+        logging.info('%s%s', question, prompt)
         choice = input('Input -> ').lower()
 
-        if (choice == default) or (choice == ''):
-            return True
-        elif (choice == 'y' or choice == 'n') and choice != default:
-            return False
+        if choice in CONFIRMATION_CHOICES:
+            return choice == default or choice == ''
         else:
             logging.warning('Invalid input supplied')
 
@@ -165,8 +459,8 @@ def main():
 
     message_group = parser.add_argument_group('message options', 'options related to email message being sent')
     message_group.add_argument('-s', dest='email_subject', required=True, help='the subject of the email')
-    message_group.add_argument('-m', dest='email_body', type=argparse.FileType('r'), required=True,
-                               help='a file containing the email body')
+    message_group.add_argument('-m', dest='email_body', type=argparse.FileType('rb'), required=True,
+                               help='a UTF-8 encoded file containing the email body')
     message_group.add_argument('-a', dest='email_attachment', type=argparse.FileType('rb'),
                                help='an attachment to include with the email')
     message_group.add_argument('--encoding', dest='message_format', choices=['plain', 'html'], default='html',
@@ -178,7 +472,12 @@ def main():
     server_group.add_argument('-i', dest='smtp_server', required=True, help='the IP address or FQDN of the SMTP server')
     server_group.add_argument('--port', dest='smtp_port', type=int, default=25, help='the port of the SMTP server')
     server_group.add_argument('--delay', dest='sending_delay', type=int, default=10,
-                              help='the number of seconds to wait between sending each message')
+                              help='the number of seconds each connection waits between sending messages')
+    server_group.add_argument('--smtp-timeout', dest='smtp_timeout', type=float, default=30,
+                              help='the number of seconds to wait on an unresponsive SMTP server before reconnecting, '
+                                   'a message that timed out after being transmitted may be delivered twice')
+    server_group.add_argument('--concurrency', dest='concurrency', type=int, default=1,
+                              help='the number of simultaneous SMTP connections used when sending to multiple recipients')
     server_group.add_argument('--username', dest='smtp_username', help='username for SMTP authentication')
     server_group.add_argument('--password', dest='smtp_password', help='password for SMTP authentication')
     cli_args = parser.parse_args()
@@ -192,10 +491,31 @@ def main():
        logging.error('Both a username and password is required for SMTP authentication')
        exit()
 
+    if cli_args.concurrency < 1:
+        logging.error('At least one SMTP connection is required for sending')
+        exit()
+
+    if cli_args.smtp_timeout <= 0:
+        logging.error('The SMTP timeout must be a positive number of seconds')
+        exit()
+
+    # Read and decode the message body once so no file handles are shared between workers
+    try:
+        cli_args.email_body_text = cli_args.email_body.read().decode('utf-8')
+    except UnicodeDecodeError:
+        logging.error('The email body in %s is not valid UTF-8 text', cli_args.email_body.name)
+        exit()
+    finally:
+        cli_args.email_body.close()
+
+    # Prepare the headers and attachment shared by every email
+    prepare_headers(cli_args)
+    prepare_attachment(cli_args)
+
     # Entry point processing
     if cli_args.recipient is not None:
         logging.info('Processing a single email to %s', cli_args.recipient)
-        send_email(cli_args.recipient, cli_args)
+        send_email(cli_args.recipient, build_template(cli_args), cli_args)
     elif cli_args.recipient_file is not None:
         logging.info('Processing multiple emails to individuals in the file at %s', cli_args.recipient_file.name)
         send_multiple_emails(cli_args.recipient_file, cli_args)